@@ -1,14 +1,29 @@
-import json
+import asyncio
 import os
-import time
 import logging
-import requests
+import random
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import aiohttp
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from apscheduler.schedulers.blocking import BlockingScheduler
-from requests.exceptions import HTTPError, RequestException
+import ijson
+import xxhash
+from aiolimiter import AsyncLimiter
+from google.oauth2.service_account import Credentials
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:  # без orjson работаем на stdlib json, просто медленнее
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
 load_dotenv()
 
 # ==== Настройки ====
@@ -17,11 +32,21 @@ PER_PAGE = 250            # Запрашиваем по 200 монет за за
 TOTAL_COINS = 2000       # «Фризим» первые 2000
 PAGES = TOTAL_COINS // PER_PAGE  # =20 страниц
 CURRENCY = "usd"
+MAX_IDS_PARAM_LEN = 4000  # Предел длины параметра ids (символов), чтобы URL не был слишком длинным
+COIN_FIELDS = ("id", "symbol", "current_price")  # Что используем из ответа /coins/markets
+CONCURRENCY = 5          # Одновременных запросов к CoinGecko
+RATE_LIMIT_PER_MIN = 25  # Запросов к CoinGecko в минуту
+RATE_LIMIT_LOW_WATER = 5  # Порог X-RateLimit-Remaining, ниже которого притормаживаем
+RATE_LIMIT_COOLDOWN = 5  # Пауза при почти исчерпанной квоте, сек
+MAX_RETRIES = 10         # Попыток на один запрос
+BACKOFF_BASE = 1         # Базовая пауза backoff, сек
+BACKOFF_CAP = 60         # Максимальная пауза backoff, сек
 
 SERVICE_ACCOUNT_FILE = "credentials.json"
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 WORKSHEET_NAME = "Цена"
-FROZEN_FILE = "frozen_coins.json"  # локальный кеш списка id
+FROZEN_FILE = "frozen_coins.json"  # локальный кеш id и последних цен
+CACHE_VERSION = 3
 
 # ==== Логирование ====
 logging.basicConfig(
@@ -37,86 +62,243 @@ def get_gsheet_client():
         "https://spreadsheets.google.com/feeds",
         "https://www.googleapis.com/auth/drive"
     ]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
+    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scope)
     client = gspread.authorize(creds)
     return client
 
-# ==== Чтение/запись локального кеша «зажатых» монет ====
+# Открытая таблица (клиент + проверенный лист) кешируется между тиками
+_SPREADSHEET = None
+
+def get_spreadsheet():
+    global _SPREADSHEET
+    if _SPREADSHEET is None:
+        sheet = get_gsheet_client().open_by_key(SPREADSHEET_ID)
+        ensure_worksheet(sheet)
+        _SPREADSHEET = sheet
+    return _SPREADSHEET
+
+def reset_spreadsheet():
+    """Сбрасывает кеш, следующий get_spreadsheet() заново авторизуется и откроет таблицу."""
+    global _SPREADSHEET
+    _SPREADSHEET = None
+
+def is_unauthorized(error):
+    return isinstance(error, gspread.exceptions.APIError) and error.code == 401
+
+def is_missing_worksheet(error):
+    """400 «Unable to parse range» — лист WORKSHEET_NAME удалён или переименован."""
+    return (isinstance(error, gspread.exceptions.APIError) and error.code == 400
+            and "Unable to parse range" in str(error))
+
+def is_stale_spreadsheet(error):
+    """Ошибки, после которых закешированную таблицу нужно открыть заново (см. reset_spreadsheet)."""
+    return is_unauthorized(error) or is_missing_worksheet(error)
+
+# ==== Чтение/запись локального кеша «зажатых» монет и последних записанных цен ====
+# Формат файла: строка метаданных {"version": CACHE_VERSION, "xxh3": "..."} и "\n", за ней —
+# JSON {"ids": [...], "last_prices": [...]} как есть. xxh3 — xxh3_64 ровно от этих байтов после "\n",
+# так что проверка не зависит от сериализатора. Пустая цена ("") — в ячейке пусто.
 def load_frozen_coins():
+    """Возвращает (ids, prices); prices = None, если цены в кеше не сохранены."""
     if os.path.exists(FROZEN_FILE):
         try:
-            with open(FROZEN_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list) and len(data) >= TOTAL_COINS:
-                    logger.info("Загружены %d «фризнутых» монет из локального кеша.", len(data))
-                    return data[:TOTAL_COINS]
+            with open(FROZEN_FILE, "rb") as f:
+                meta_line, _, payload = f.read().partition(b"\n")
+            meta = json_loads(meta_line)
+            if meta.get("version") != CACHE_VERSION:
+                logger.warning("Неизвестная версия %s — кеш отброшен.", FROZEN_FILE)
+                return None, None
+            if xxhash.xxh3_64_hexdigest(payload) != meta.get("xxh3"):
+                logger.warning("Контрольная сумма %s не совпадает — кеш отброшен.", FROZEN_FILE)
+                return None, None
+            data = json_loads(payload)
+            ids, prices = data["ids"], data["last_prices"]
+            if len(ids) >= TOTAL_COINS:
+                prices = prices[:TOTAL_COINS] if len(prices) >= TOTAL_COINS else None
+                logger.info("Загружены %d «фризнутых» монет из локального кеша.", TOTAL_COINS)
+                return ids[:TOTAL_COINS], prices
         except Exception as e:
             logger.warning("Не удалось прочитать %s: %s", FROZEN_FILE, e)
-    return None
+    return None, None
 
-def save_frozen_coins(ids):
+def save_frozen_coins(ids, prices):
+    """Пишет во временный файл и атомарно подменяет кеш: при сбое на диске остаётся старая или новая версия."""
+    tmp_file = FROZEN_FILE + ".tmp"
     try:
-        with open(FROZEN_FILE, "w", encoding="utf-8") as f:
-            json.dump(ids, f, ensure_ascii=False)
+        payload = json_dumps({
+            "ids": ids,
+            "last_prices": ["" if price is None else price for price in prices]
+        })
+        meta_line = json_dumps({"version": CACHE_VERSION, "xxh3": xxhash.xxh3_64_hexdigest(payload)})
+        with open(tmp_file, "wb") as f:
+            f.write(meta_line + b"\n" + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, FROZEN_FILE)
         logger.info("Локальный кеш сохранён (%s) с %d ID.", FROZEN_FILE, len(ids))
     except Exception as e:
         logger.error("Ошибка сохранения локального кеша: %s", e)
 
-# ==== Сбор топ-2000 (id, symbol, price) с бесконечным retry при 429 ====
-def fetch_top_coins_with_price():
+# ==== Общий асинхронный GET к /coins/markets ====
+# Один event loop на весь процесс: на нём работает scheduler и живёт HTTP-сессия.
+EVENT_LOOP = asyncio.new_event_loop()
+# Пул для блокирующих вызовов gspread (asyncio.to_thread): сеть не держит event loop и scheduler
+EVENT_LOOP.set_default_executor(ThreadPoolExecutor(max_workers=4, thread_name_prefix="sheets"))
+_HTTP_SESSION = None
+# Token bucket под публичный лимит CoinGecko: ждём, только когда токены кончились
+LIMITER = AsyncLimiter(max_rate=RATE_LIMIT_PER_MIN, time_period=60)
+# Общий для всех запросов предел одновременных обращений к CoinGecko
+SEM = asyncio.Semaphore(CONCURRENCY)
+
+def get_http_session():
+    """
+    Общая сессия с пулом keep-alive соединений, переиспользуется между тиками.
+    Создаётся лениво внутри EVENT_LOOP — сессия привязана к циклу, в котором создана.
+    """
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        _HTTP_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=10, limit_per_host=CONCURRENCY, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=15),
+            headers={"Accept-Encoding": "gzip"}
+        )
+    return _HTTP_SESSION
+
+async def close_http_session():
+    if _HTTP_SESSION is not None and not _HTTP_SESSION.closed:
+        await _HTTP_SESSION.close()
+
+def _backoff_delay(attempt, retry_after=None):
+    """
+    Пауза перед повтором: Retry-After от сервера, если он есть,
+    иначе экспоненциальный backoff с full jitter — случайно в [0, min(CAP, BASE * 2^attempt)).
+    """
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass  # Retry-After в формате HTTP-date — считаем сами
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+_project_coin = itemgetter(*COIN_FIELDS)
+
+async def _iter_json_array(stream):
+    """
+    Потоково отдаёт элементы JSON-массива верхнего уровня.
+    Если ответ не массив (например, объект {"status": {...}} с ошибкой) — ValueError.
+    """
+    started = False
+    depth = 0  # вложенность внутри текущего элемента
+    builder = None
+    async for _, event, value in ijson.parse(stream, use_float=True):
+        if not started:
+            if event != "start_array":
+                raise ValueError(f"Ответ не JSON-массив (первое событие {event!r})")
+            started = True
+            continue
+        if depth == 0 and event == "end_array":
+            return
+        if builder is None:
+            builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            yield builder.value
+            builder = None
+
+async def request_with_backoff(session, url, params, label, min_len=0):
+    """
+    GET с повторами (не больше MAX_RETRIES попыток) при HTTP 429, сетевых ошибках
+    и неверных ответах (не JSON-массив или меньше min_len записей); паузы — см. _backoff_delay.
+    Если по X-RateLimit-Remaining квота почти исчерпана, выжидает RATE_LIMIT_COOLDOWN сек.
+    Ответ (JSON-массив монет) разбирается потоково через ijson: от каждой монеты сразу
+    остаётся кортеж полей COIN_FIELDS, весь документ в памяти не собирается.
+    Возвращает список кортежей; при прочих HTTP-ошибках или исчерпании попыток — None.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with LIMITER, session.get(url, params=params) as resp:
+                resp.raise_for_status()
+                data = [
+                    _project_coin(coin)
+                    async for coin in _iter_json_array(resp.content)
+                ]
+                remaining = resp.headers.get("X-RateLimit-Remaining", "")
+            if remaining.isdigit() and int(remaining) < RATE_LIMIT_LOW_WATER:
+                # Квота почти кончилась — придерживаем слот SEM, чтобы не поймать 429
+                logger.info("CoinGecko: осталось %s запросов в окне, пауза %d сек.", remaining, RATE_LIMIT_COOLDOWN)
+                await asyncio.sleep(RATE_LIMIT_COOLDOWN)
+            if len(data) < min_len:
+                raise ValueError(f"Получено {len(data)} записей вместо {min_len}")
+            return data
+        except aiohttp.ClientResponseError as he:
+            if he.status != 429:
+                logger.error("HTTPError %d на %s: %s", he.status, label, he)
+                return None
+            delay = _backoff_delay(attempt, he.headers.get("Retry-After") if he.headers else None)
+            logger.warning("HTTP 429 на %s: ждём %.1f сек...", label, delay)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ijson.JSONError, KeyError, ValueError) as e:
+            delay = _backoff_delay(attempt)
+            logger.error("Ошибка на %s: %s (повтор через %.1f сек)", label, e, delay)
+        await asyncio.sleep(delay)
+
+    logger.error("Не удалось получить %s за %d попыток.", label, MAX_RETRIES)
+    return None
+
+async def fetch_page(session, params, label, min_len=0):
+    """Один запрос к CoinGecko под семафором (не больше CONCURRENCY одновременно)."""
+    async with SEM:
+        return await request_with_backoff(session, COINGECKO_URL, params, label, min_len)
+
+# ==== Сбор топ-2000 (id, symbol, price) параллельными запросами ====
+async def fetch_top_coins_with_price():
     """
-    Делает 20 запросов по 100 монет.
-    При HTTP 429 ждёт 60 сек и повторяет (без ограничения числа попыток).
-    Между удачными запросами делает паузу 10 сек.
-    Возвращает список из {"id","symbol","price"} длиной ровно TOTAL_COINS.
+    Запрашивает PAGES страниц по PER_PAGE монет параллельно (не больше CONCURRENCY сразу).
+    Повторы при 429 и неполных ответах — см. request_with_backoff.
+    Возвращает три параллельных списка (ids, symbols, prices) длиной ровно TOTAL_COINS;
+    если хоть одна страница не получена, возвращает пустые списки — неполный топ не записываем.
     """
-    items = []
-    for page in range(1, PAGES + 1):
-        while True:  # цикл до успешного получения 100 монет
-            params = {
+    session = get_http_session()
+    pages = await asyncio.gather(*(
+        fetch_page(
+            session,
+            {
                 "vs_currency": CURRENCY,
                 "order": "market_cap_desc",
                 "per_page": PER_PAGE,
                 "page": page,
-                "sparkline": False
-            }
-            try:
-                resp = requests.get(COINGECKO_URL, params=params, timeout=15)
-                resp.raise_for_status()
-                data = resp.json()
-                if not isinstance(data, list) or len(data) < PER_PAGE:
-                    # Если пришло меньше 100, возможно неполный ответ → считаем ошибкой и повторяем
-                    raise ValueError(f"Получено {len(data)} записей вместо {PER_PAGE}")
-                break
-            except HTTPError as he:
-                code = he.response.status_code
-                if code == 429:
-                    logger.warning("HTTP 429 на странице %d: ждём 60 сек...", page)
-                    time.sleep(60)
-                    continue
-                else:
-                    logger.error("HTTPError %d на странице %d: %s", code, page, he)
-                    return items
-            except (RequestException, ValueError) as e:
-                logger.error("Ошибка на странице %d: %s (будем повторять через 60 сек)", page, e)
-                time.sleep(60)
-                continue
-
-        # Успешно получили ровно 100 монет
-        for coin in data:
-            items.append({
-                "id": coin["id"],
-                "symbol": coin["symbol"].upper(),
-                "price": coin["current_price"]
-            })
-        logger.info("Страница %d: получено 100 монет (итого %d).", page, len(items))
-        time.sleep(20)  # пауза 10 сек между запросами
-
-    return items[:TOTAL_COINS]
+                "sparkline": "false"  # aiohttp не принимает bool в params
+            },
+            f"странице {page}",
+            min_len=PER_PAGE
+        )
+        for page in range(1, PAGES + 1)
+    ))
+
+    failed = [page for page, data in enumerate(pages, start=1) if data is None]
+    if failed:
+        logger.error("Не получены страницы %s — инициализацию откладываем до следующего тика.", failed)
+        return [], [], []
+
+    ids = [None] * TOTAL_COINS
+    symbols = [None] * TOTAL_COINS
+    prices = [None] * TOTAL_COINS
+    count = 0
+    for page, data in enumerate(pages, start=1):
+        for coin_id, symbol, price in data[:TOTAL_COINS - count]:
+            ids[count] = coin_id
+            symbols[count] = symbol.upper()
+            prices[count] = price
+            count += 1
+        logger.info("Страница %d: получено %d монет (итого %d).", page, len(data), count)
+
+    return ids, symbols, prices
 
 # ==== Проверка и создание листа в Google Sheets ====
-def ensure_worksheet(client):
-    sheet = client.open_by_key(SPREADSHEET_ID)
+def ensure_worksheet(sheet):
     try:
         return sheet.worksheet(WORKSHEET_NAME)
     except gspread.exceptions.WorksheetNotFound:
@@ -128,109 +310,254 @@ def ensure_worksheet(client):
         logger.info("Создан новый лист «%s» с %d строк и 3 колонками.", WORKSHEET_NAME, TOTAL_COINS + 1)
         return wks
 
+# ==== Состояние листа одним запросом values.batchGet ====
+def read_sheet_state(sheet, with_ids):
+    """
+    Читает заголовок A1 и, если with_ids, id из A2:A{TOTAL_COINS+1} — за один запрос.
+    Возвращает (header, ids). Ошибки чтения пробрасываются: пустой A1 должен означать
+    пустой лист, а не сбой запроса, иначе sync_to_sheet перезапишет таблицу заново.
+    """
+    ranges = [f"'{WORKSHEET_NAME}'!A1"]
+    if with_ids:
+        ranges.append(f"'{WORKSHEET_NAME}'!A2:A{TOTAL_COINS + 1}")
+    value_ranges = sheet.values_batch_get(ranges).get("valueRanges", [])
+
+    columns = [[row[0] if row else "" for row in vr.get("values", [])] for vr in value_ranges]
+    header = columns[0][0] if columns and columns[0] else None
+    ids = columns[1] if len(columns) > 1 else []
+    return header, ids
+
+# ==== Запись диапазонов одним запросом values.batchUpdate ====
+def write_ranges(sheet, data):
+    """
+    data: список пар (range_name, values) в пределах листа WORKSHEET_NAME.
+    Все диапазоны уходят одним POST; RAW — без серверного разбора формул.
+    """
+    try:
+        sheet.values_batch_update({
+            "valueInputOption": "RAW",
+            "data": [
+                {"range": f"'{WORKSHEET_NAME}'!{range_name}", "values": values}
+                for range_name, values in data
+            ]
+        })
+    except gspread.exceptions.APIError as e:
+        if is_stale_spreadsheet(e):
+            reset_spreadsheet()  # на следующем тике авторизуемся и проверим лист заново
+        raise
+
+# ==== Диапазоны изменившихся цен ====
+def changed_price_ranges(old_prices, new_prices):
+    """
+    Сравнивает цены построчно и склеивает подряд идущие изменения в диапазоны
+    столбца C (первая цена — строка 2): [("C7:C11", [[p], ...]), ...].
+    """
+    data = []
+    run = []
+    for i, (old, new) in enumerate(zip(old_prices, new_prices)):
+        if old != new:
+            if not run:
+                start_row = i + 2
+            run.append([new])
+        elif run:
+            data.append((f"C{start_row}:C{start_row + len(run) - 1}", run))
+            run = []
+    if run:
+        data.append((f"C{start_row}:C{start_row + len(run) - 1}", run))
+    return data
+
 # ==== Полная запись (ID, Ticker, Price) ====
-def write_full_table(wks, coins):
+def write_full_table(sheet, ids, symbols, prices):
     """
-    coins: список словарей [{id, symbol, price}, ...] длиной TOTAL_COINS.
+    ids, symbols, prices: параллельные списки длиной TOTAL_COINS.
     Записывает диапазон A1:C{TOTAL_COINS+1}.
     """
     values = [["ID", "Ticker", "Price (USD)"]]
-    for coin in coins:
-        values.append([coin["id"], coin["symbol"], coin["price"]])
+    values.extend(map(list, zip(ids, symbols, prices)))
 
     last_row = len(values)  # должно быть TOTAL_COINS + 1
     range_name = f"A1:C{last_row}"
-    wks.update(values, range_name)
+    write_ranges(sheet, [(range_name, values)])
     logger.info("Записано %d строк в диапазон %s.", last_row - 1, range_name)
 
-# ==== Обновление только цен (столбец C2:C?) ====
-def update_prices_only(wks, frozen_ids):
+# ==== Цены «фризнутых» монет ====
+def chunk_ids(ids):
+    """
+    Жадно набирает id в пачки: не больше PER_PAGE штук (больше /coins/markets за раз не отдаёт)
+    и не длиннее MAX_IDS_PARAM_LEN символов в параметре ids, чтобы не упереться в длину URL.
+    """
+    chunks = []
+    chunk = []
+    size = 0
+    for coin_id in ids:
+        if chunk and (len(chunk) == PER_PAGE or size + 1 + len(coin_id) > MAX_IDS_PARAM_LEN):
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        size += len(coin_id) + (1 if chunk else 0)
+        chunk.append(coin_id)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+async def fetch_prices(frozen_ids, last_prices=None):
     """
     frozen_ids: список из TOTAL_COINS id, «жёстко» зафиксированных.
-    Берёт цены пачками по PER_PAGE, при 429 – ждёт 60 сек и пробует снова.
+    last_prices: цены, записанные в прошлый раз, или None.
+    Берёт цены пачками (см. chunk_ids) параллельно, при 429 – повтор с backoff.
+    Возвращает цены в порядке frozen_ids ("" — монеты нет в ответе CoinGecko).
+    Для пачек, которые так и не получены, оставляет прошлые цены; если их нет — возвращает None.
     """
-    total = len(frozen_ids)
-    prices = []
-    for i in range(0, total, PER_PAGE):
-        chunk = frozen_ids[i:i + PER_PAGE]
-        while True:
-            params = {
+    chunks = chunk_ids(frozen_ids)
+    session = get_http_session()
+    results = await asyncio.gather(*(
+        fetch_page(
+            session,
+            {
                 "vs_currency": CURRENCY,
                 "ids": ",".join(chunk),
                 "order": "market_cap_desc",
                 "per_page": PER_PAGE,
                 "page": 1,
-                "sparkline": False
-            }
-            try:
-                resp = requests.get(COINGECKO_URL, params=params, timeout=15)
-                resp.raise_for_status()
-                data = resp.json()
-                break
-            except HTTPError as he:
-                code = he.response.status_code
-                if code == 429:
-                    logger.warning("HTTP 429 при обновлении batch %d: ждём 60 сек...", i // PER_PAGE + 1)
-                    time.sleep(60)
-                    continue
-                else:
-                    logger.error("HTTPError %d при обновлении batch %d: %s", code, i // PER_PAGE + 1, he)
-                    data = []
-                    break
-            except RequestException as e:
-                logger.error("Ошибка при запросе batch %d: %s", i // PER_PAGE + 1, e)
-                time.sleep(60)
-                continue
-
-        price_map = {c["id"]: c["current_price"] for c in data}
-        for coin_id in chunk:
-            prices.append([price_map.get(coin_id, "")])
-        logger.info("Batch %d: добавлено %d цен.", i // PER_PAGE + 1, len(chunk))
-        time.sleep(10)  # пауза 10 сек между пакетами
-
-    last_row = total + 1
-    range_name = f"C2:C{last_row}"
-    wks.update(prices, range_name)
-    logger.info("Обновлено %d цен (диапазон %s).", total, range_name)
+                "sparkline": "false"
+            },
+            f"batch {n}"
+        )
+        for n, chunk in enumerate(chunks, start=1)
+    ))
+
+    price_map = {}
+    failed_ids = set()
+    for n, (chunk, data) in enumerate(zip(chunks, results), start=1):
+        if data is None:
+            failed_ids.update(chunk)
+            continue
+        price_map.update((coin_id, price) for coin_id, _, price in data)
+        logger.info("Batch %d: получено %d цен из %d.", n, len(data), len(chunk))
+
+    if failed_ids and (last_prices is None or len(last_prices) != len(frozen_ids)):
+        logger.error("Не получено %d цен, прошлых цен нет — запись пропущена.", len(failed_ids))
+        return None
+
+    prices = []
+    for i, coin_id in enumerate(frozen_ids):
+        if coin_id in failed_ids:
+            prices.append(last_prices[i])
+            continue
+        price = price_map.get(coin_id)
+        prices.append("" if price is None else price)
+    if failed_ids:
+        logger.warning("Для %d монет цены не получены — оставлены прошлые.", len(failed_ids))
+    return prices
+
+# ==== Обновление только цен (столбец C2:C?) ====
+def update_prices_only(sheet, prices, last_prices=None):
+    """
+    prices: новые цены в порядке «фризнутых» id.
+    last_prices: цены, записанные в прошлый раз (из локального кеша), или None.
+    Если прошлые цены известны, пишет только изменившиеся ячейки, иначе весь столбец.
+    """
+    total = len(prices)
+    if last_prices is None or len(last_prices) != total:
+        last_row = total + 1
+        range_name = f"C2:C{last_row}"
+        write_ranges(sheet, [(range_name, [[p] for p in prices])])
+        logger.info("Обновлено %d цен (диапазон %s).", total, range_name)
+        return
+
+    data = changed_price_ranges(last_prices, prices)
+    if not data:
+        logger.info("Цены не изменились с прошлого обновления — запись пропущена.")
+        return
+    write_ranges(sheet, data)
+    logger.info("Обновлено %d цен из %d (%d диапазонов).",
+                sum(len(values) for _, values in data), total, len(data))
 
 # ==== Основная синхронизация ====
-def sync_to_sheet():
-    client = get_gsheet_client()
-    wks = ensure_worksheet(client)
+def open_sheet(with_ids):
+    """
+    Берёт закешированную таблицу и читает состояние листа (блокирующие вызовы gspread).
+    При 401 или пропавшем листе один раз переоткрывает таблицу: заново авторизуется
+    и через ensure_worksheet при необходимости создаёт лист.
+    """
+    try:
+        sheet = get_spreadsheet()
+        return (sheet, *read_sheet_state(sheet, with_ids))
+    except gspread.exceptions.APIError as e:
+        if not is_stale_spreadsheet(e):
+            raise
+        if is_unauthorized(e):
+            logger.warning("Google Sheets ответил 401 — переавторизуемся.")
+        else:
+            logger.warning("Лист «%s» не найден — открываем таблицу заново.", WORKSHEET_NAME)
+        reset_spreadsheet()
+        sheet = get_spreadsheet()
+        return (sheet, *read_sheet_state(sheet, with_ids))
 
+async def sync_to_sheet():
+    """
+    Вызовы gspread блокирующие — уходят в поток через asyncio.to_thread.
+    Если id есть в локальном кеше, цены начинаем тянуть сразу, параллельно с чтением листа.
+    Если лист не прочитан или требует инициализации, загрузка цен отменяется; уже
+    отправленные за время чтения листа запросы (обычно первые CONCURRENCY) всё равно
+    расходуют токены LIMITER — это цена перекрытия, а инициализация бывает только раз.
+    """
+    frozen_ids, last_prices = load_frozen_coins()
+    prices_task = asyncio.create_task(fetch_prices(frozen_ids, last_prices)) if frozen_ids else None
     try:
-        header = wks.acell("A1").value
-    except Exception:
-        header = None
+        sheet, header, sheet_ids = await asyncio.to_thread(open_sheet, not frozen_ids)
+    except Exception as e:
+        if prices_task:
+            prices_task.cancel()
+        logger.error("Не удалось прочитать лист «%s»: %s — пропускаем тик.", WORKSHEET_NAME, e)
+        return
 
     if header != "ID":
         # Первый раз: скачиваем топ-2000 и сохраняем локально «фризнутые» id
         logger.info("Первичная инициализация: скачиваем топ-2000 монет…")
-        coins = fetch_top_coins_with_price()
-        if not coins:
-            logger.error("Не удалось получить ни одной монеты. Выходим.")
+        if prices_task:
+            prices_task.cancel()
+        ids, symbols, prices = await fetch_top_coins_with_price()
+        if not ids:
+            logger.error("Топ-%d получен не полностью — лист не трогаем. Выходим.", TOTAL_COINS)
             return
-        write_full_table(wks, coins)
-        frozen_ids = [c["id"] for c in coins]
-        save_frozen_coins(frozen_ids)
+        await asyncio.to_thread(write_full_table, sheet, ids, symbols, prices)
+        save_frozen_coins(ids, prices)
     else:
         # Последующие запуски: обновляем только колонки C
-        frozen_ids = load_frozen_coins()
-        if not frozen_ids:
-            logger.info("Локальный кеш не найден, читаем ID из столбца A…")
-            frozen_ids = wks.col_values(1)[1:TOTAL_COINS + 1]
-        update_prices_only(wks, frozen_ids)
+        if prices_task:
+            prices = await prices_task
+        else:
+            # Аварийный путь: кеш пишется атомарно, сюда попадаем, только если файла нет или он повреждён
+            logger.warning("Локальный кеш не найден, берём ID из столбца A…")
+            frozen_ids = sheet_ids
+            prices = await fetch_prices(frozen_ids)
+        if prices is None:
+            return
+        await asyncio.to_thread(update_prices_only, sheet, prices, last_prices)
+        save_frozen_coins(frozen_ids, prices)
 
 # ==== Запуск APScheduler каждые 15 минут ====
 if __name__ == "__main__":
     logger.info("=== Старт скрипта ===")
-    scheduler = BlockingScheduler(timezone="UTC")
+    scheduler = AsyncIOScheduler(event_loop=EVENT_LOOP, timezone="UTC")
     # Первая синхронизация сразу
-    sync_to_sheet()
-    # Далее каждые 15 минут
-    scheduler.add_job(sync_to_sheet, "interval", minutes=15)
+    EVENT_LOOP.run_until_complete(sync_to_sheet())
+    # Далее каждые 15 минут. Если прошлая синхронизация ещё идёт, очередной запуск пропускается
+    # (max_instances=1, APScheduler пишет «maximum number of running instances reached»);
+    # coalesce схлопывает запуски, пропущенные при занятом loop, в один, а misfire_grace_time=None
+    # не даёт отбросить такой запоздавший запуск.
+    scheduler.add_job(
+        sync_to_sheet, "interval", minutes=15,
+        max_instances=1, coalesce=True, misfire_grace_time=None
+    )
+    scheduler.start()
     logger.info("Scheduler запущен. Обновление каждые 15 минут.")
     try:
-        scheduler.start()
+        EVENT_LOOP.run_forever()
     except (KeyboardInterrupt, SystemExit):
         logger.info("Scheduler остановлен пользователем.")
+    finally:
+        EVENT_LOOP.run_until_complete(close_http_session())
+        EVENT_LOOP.run_until_complete(EVENT_LOOP.shutdown_default_executor())
+        EVENT_LOOP.close()